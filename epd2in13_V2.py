@@ -111,6 +111,19 @@ class EPD:
         self.send_command(0x20)        
         self.ReadBusy()
         
+    # Analog block (high drive voltages) on/off, the panel RAM is kept so partial updates can continue
+    def PowerOn(self):
+        self.send_command(0x22)
+        self.send_data(0xC0)
+        self.send_command(0x20)
+        self.ReadBusy()
+
+    def PowerOff(self):
+        self.send_command(0x22)
+        self.send_data(0xC3)
+        self.send_command(0x20)
+        self.ReadBusy()
+
     def init(self, update):
         if (epdconfig.module_init() != 0):
             return -1
@@ -208,7 +221,8 @@ class EPD:
             linewidth = int(self.width/8) + 1
          
         buf = [0xFF] * (linewidth * self.height)
-        image_monocolor = image.convert('1')
+        # convert() on an image that is already 1-bit is just a full copy
+        image_monocolor = image if image.mode == '1' else image.convert('1')
         imwidth, imheight = image_monocolor.size
         pixels = image_monocolor.load()
         
@@ -253,6 +267,52 @@ class EPD:
         self.send_data2(buf)  
         self.TurnOnDisplayPart()
 
+    # Partial update sending only rows firstRow..lastRow and bytes firstByte..lastByte of a full buffer
+    def displayPartialWindow(self, image, firstRow, lastRow, firstByte, lastByte):
+        if self.width%8 == 0:
+            linewidth = int(self.width/8)
+        else:
+            linewidth = int(self.width/8) + 1
+
+        window = []
+        for j in range(firstRow, lastRow + 1):
+            window.extend(image[firstByte + j * linewidth:lastByte + 1 + j * linewidth])
+
+        # Same data entry mode as FULL_UPDATE: X increment, Y decrement from the last gate line
+        self.send_command(0x11) #data entry mode
+        self.send_data(0x01)
+        self.SetWindow(firstByte, lastByte, self.height - 1 - firstRow, self.height - 1 - lastRow)
+
+        self.send_command(0x24)
+        self.send_data2(window)
+
+        self.SetCursor(firstByte, self.height - 1 - firstRow)
+        self.send_command(0x26)
+        self.send_data2([~data & 0xFF for data in window])
+
+        # Restore the full window for the next full-frame write
+        self.SetWindow(0, linewidth - 1, self.height - 1, 0)
+        self.TurnOnDisplayPart()
+
+    def SetWindow(self, xStart, xEnd, yStart, yEnd):
+        self.send_command(0x44) #set Ram-X address start/end position
+        self.send_data(xStart)
+        self.send_data(xEnd)
+
+        self.send_command(0x45) #set Ram-Y address start/end position
+        self.send_data(yStart & 0xFF)
+        self.send_data((yStart >> 8) & 0x01)
+        self.send_data(yEnd & 0xFF)
+        self.send_data((yEnd >> 8) & 0x01)
+        self.SetCursor(xStart, yStart)
+
+    def SetCursor(self, x, y):
+        self.send_command(0x4E)   # set RAM x address count
+        self.send_data(x)
+        self.send_command(0x4F)   # set RAM y address count
+        self.send_data(y & 0xFF)
+        self.send_data((y >> 8) & 0x01)
+
     def displayPartBaseImage(self, image):
         self.send_command(0x24)
         self.send_data2(image)   
@@ -39,6 +39,7 @@ class RaspberryPi:
         # self.GPIO_CS_PIN     = gpiozero.LED(self.CS_PIN)
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
+        self.spi_open = False
 
     def digital_write(self, pin, value):
         if pin == self.RST_PIN:
@@ -117,16 +118,19 @@ class RaspberryPi:
 
             self.DEV_SPI.DEV_Module_Init()
 
-        else:
+        elif not self.spi_open:
             # SPI device, bus = 0, device = 0
+            # Opened once: spidev's open() doesn't close the fd it already holds, so repeated init() calls would leak it
             self.SPI.open(0, 0)
             self.SPI.max_speed_hz = 4000000
             self.SPI.mode = 0b00
+            self.spi_open = True
         return 0
 
     def module_exit(self, cleanup=False):
         LOG.debug("SPI End")
         self.SPI.close()
+        self.spi_open = False
 
         self.GPIO_RST_PIN.off()
         self.GPIO_DC_PIN.off()
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 import logging
+import os
+import signal
+import sys
+import time
 import datetime
+import socket
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image, ImageDraw, ImageFont
 import epd2in13_V2
 
 # === Logger ===
@@ -14,6 +22,29 @@ logging.basicConfig(level=logging.DEBUG)
 USER_PATH = '/home/secrets/pihole_user'
 PW_PATH = '/home/secrets/pihole_pw'
 LOW_BATTERY_THRESHOLD = 20
+REFRESH_INTERVAL = 60
+FULL_REFRESH_EVERY = 30
+
+# === Fonts ===
+# Loaded once and reused by every refresh
+FONT_SMALL = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 14)
+FONT_SMALL_BOLD = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 14)
+FONT_BIG_BOLD = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 16)
+
+# === HTTP ===
+# (connect, read) timeouts so a dead Pi-hole can't stall the refresh
+HTTP_TIMEOUT = (1.0, 3.0)
+# One keep-alive session shared by every Pi-hole API call
+SESSION = requests.Session()
+SESSION.trust_env = False
+# Short bounded retries so a transient blip doesn't blank a whole refresh. POST (auth) is left out: retrying
+# after a read timeout could create a second sid that is never logged out and holds an API seat
+HTTP_RETRIES = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=("GET", "DELETE"))
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=HTTP_RETRIES))
+SESSION.headers["Connection"] = "keep-alive"
+
+# Pi-hole API sessions kept across refreshes, keyed by host
+SIDS = {}
 
 # === Aux funcs ===
 def readFromFile(path):
@@ -26,9 +57,10 @@ def readFromFile(path):
 
 def getBattery():
     try:
-        LOG.debug("getBattery - Getting battery info via netcat")
-        command = 'echo "get battery" | nc -q 0 127.0.0.1 8423'
-        output = subprocess.check_output(command, shell=True, text=True)
+        LOG.debug("getBattery - Getting battery info from the PiSugar server")
+        with socket.create_connection(("127.0.0.1", 8423), timeout=1) as sock:
+            sock.sendall(b"get battery\n")
+            output = sock.recv(128).decode()
         for line in output.splitlines():
             if line.lower().startswith("battery:"):
                 battery_value = float(line.split(":")[1].strip())
@@ -36,7 +68,7 @@ def getBattery():
                 return int(round(battery_value))
         return "N/A"
     except Exception as e:
-        LOG.error(f"getBattery - Error getting battery status via netcat: {e}")
+        LOG.error(f"getBattery - Error getting battery status: {e}")
         return "N/A"
 
 # === PiHole funcs ===
@@ -44,7 +76,7 @@ def authenticate(ip, password):
     url = f"http://{ip}/api/auth"
     payload = {"password": password}
     try:
-        response = requests.post(url, json=payload, timeout=5)
+        response = SESSION.post(url, json=payload, timeout=HTTP_TIMEOUT)
         data = response.json()
         if not data.get("session", {}).get("valid"):
             raise Exception("Session is not valid")
@@ -56,143 +88,274 @@ def authenticate(ip, password):
 def logout(ip, sid):
     url = f"http://{ip}/api/auth"
     try:
-        requests.delete(url, headers={"sid": sid}, timeout=5)
+        SESSION.delete(url, headers={"sid": sid}, timeout=HTTP_TIMEOUT)
     except Exception as e:
         LOG.error(f"logout - Logout failed for {ip}: {e}")
 
-def getPiHoleData(ip, password):
-    sid = authenticate(ip, password)
-    if not sid:
-        return "N/A", 0.0
-    try:
-        summary_url = f"http://{ip}/api/stats/summary"
-        response = requests.get(summary_url, headers={"sid": sid}, timeout=5)
-        resquestsNumber = response.json()["queries"].get("total")
-        blockedPercentage = response.json()["queries"].get("percent_blocked", 0.0)
-        return resquestsNumber, float(f"{blockedPercentage:.2f}")
-    except Exception as e:
-        LOG.error(f"getPiHoleData - Error getting PiHole data from {ip}: {e}")
-        return "N/A", 0.0
-    finally:
+def logoutAll():
+    for ip, sid in list(SIDS.items()):
         logout(ip, sid)
+    SIDS.clear()
+
+def getPiHoleData(ip, password):
+    summary_url = f"http://{ip}/api/stats/summary"
+    # Reuse the previous refresh's sid, authenticate again only once it has expired
+    for _ in range(2):
+        sid = SIDS.get(ip) or authenticate(ip, password)
+        if not sid:
+            return "N/A", 0.0
+        SIDS[ip] = sid
+        try:
+            response = SESSION.get(summary_url, headers={"sid": sid}, timeout=HTTP_TIMEOUT)
+            if response.status_code == 401:
+                LOG.debug(f"getPiHoleData - Session expired for {ip}, authenticating again")
+                del SIDS[ip]
+                continue
+            queries = response.json()["queries"]
+            resquestsNumber = queries.get("total")
+            blockedPercentage = queries.get("percent_blocked", 0.0)
+            return resquestsNumber, float(f"{blockedPercentage:.2f}")
+        except Exception as e:
+            LOG.error(f"getPiHoleData - Error getting PiHole data from {ip}: {e}")
+            return "N/A", 0.0
+    return "N/A", 0.0
 
 # === System ===
+# Remote uptime/temp are only fetched over SSH once per REMOTE_CACHE_TTL seconds
+REMOTE_CACHE_TTL = 180
+# Refreshes land on interval boundaries with some jitter, expire half an interval early so every
+# third refresh reads again rather than every fourth
+REMOTE_CACHE_MAX_AGE = REMOTE_CACHE_TTL - REFRESH_INTERVAL / 2
+# ip -> (monotonic time of the read, remote uptime in seconds, CPU temp)
+REMOTE_CACHE = {}
+SSH_OPTIONS = [
+    "-o", "StrictHostKeyChecking=no",
+    # Keep a master connection alive between reads so later probes skip the SSH handshake
+    "-o", "ControlMaster=auto",
+    # Socket in the user's own ~/.ssh, not world-writable /tmp where another user could pre-create it
+    "-o", "ControlPath=~/.ssh/cm-%C",
+    "-o", f"ControlPersist={int(REMOTE_CACHE_MAX_AGE) * 2}",
+]
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+# Kept open across refreshes, re-read from offset 0 each time
+THERMAL_FD = None
+
+# Temperatures are kept in integer millidegrees, as sysfs reports them
+def formatTemp(milliDegrees):
+    if not isinstance(milliDegrees, int):
+        return "N/A"
+    # Rounded to the nearest tenth in integer math, on the magnitude so negative readings format correctly
+    degrees, tenths = divmod((abs(milliDegrees) + 50) // 100, 10)
+    sign = "-" if milliDegrees < 0 and (degrees or tenths) else ""
+    return f"{sign}{degrees}.{tenths}"
+
+def formatUpTime(uptimeSeconds):
+    hours, minutes = divmod(uptimeSeconds // 60, 60)
+    return f"{hours}h {minutes}m"
+
 def getLocalUpTime():
     try:
-        with open("/proc/uptime", "r") as f:
-            uptimeSeconds = float(f.readline().split()[0])
-            hours = int(uptimeSeconds // 3600)
-            minutes = int((uptimeSeconds % 3600) // 60)
-            return f"{hours}h {minutes}m"
+        return formatUpTime(int(time.clock_gettime(time.CLOCK_BOOTTIME)))
     except Exception as e:
         LOG.error(f"getLocalUpTime - Error reading local uptime: {e}")
         return "N/A"
 
 def getLocalCPUTemp():
+    global THERMAL_FD
     try:
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-            return round(int(f.read()) / 1000, 1)
+        if THERMAL_FD is None:
+            THERMAL_FD = os.open(THERMAL_PATH, os.O_RDONLY)
+        return int(os.pread(THERMAL_FD, 16, 0))
     except Exception as e:
         LOG.error(f"getLocalCPUTemp - Error reading local CPU temp: {e}")
         return "N/A"
 
-def getRemoteUpTime(ip, user, password):
+def getRemoteData(ip, user, password):
+    cached = REMOTE_CACHE.get(ip)
+    if cached and time.monotonic() - cached[0] < REMOTE_CACHE_MAX_AGE:
+        readAt, uptimeSeconds, temp = cached
+        # Uptime advances with the local clock, only the temperature is a couple of refreshes old
+        return formatUpTime(uptimeSeconds + int(time.monotonic() - readAt)), temp
+
     try:
-        LOG.debug(f"getRemoteUpTime - Reading remote uptime on: {ip}")
-        command = f"sshpass -p '{password}' ssh -o StrictHostKeyChecking=no {user}@{ip} cat /proc/uptime"
-        output = subprocess.getoutput(command)
-        uptimeSeconds = float(output.split()[0])
-        hours = int(uptimeSeconds // 3600)
-        minutes = int((uptimeSeconds % 3600) // 60)
-        return f"{hours}h {minutes}m"
+        LOG.debug(f"getRemoteData - Reading remote uptime and CPU Temp on: {ip}")
+        # Both files in one SSH session to pay for a single handshake
+        remoteCommand = f"cat /proc/uptime; echo ---; cat {THERMAL_PATH}"
+        command = ["sshpass", "-p", password, "ssh", *SSH_OPTIONS, f"{user}@{ip}", remoteCommand]
+        # Stamped before the call so the SSH duration doesn't stretch the cache lifetime
+        readAt = time.monotonic()
+        # stderr is not captured: the background master would hold the pipe open and block run()
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=10).stdout
+        uptimeOutput, tempOutput = output.split("---")
     except Exception as e:
-        LOG.error(f"getRemoteUpTime - Error reading remote uptime: {e}")
-        return "N/A"
+        LOG.error(f"getRemoteData - Error reading remote data: {e}")
+        return "N/A", "N/A"
 
-def getRemoteCPUTemp(ip, user, password):
     try:
-        LOG.debug(f"getRemoteCPUTemp - Reading remote CPU Temp on: {ip}")
-        command = f"sshpass -p '{password}' ssh -o StrictHostKeyChecking=no {user}@{ip} cat /sys/class/thermal/thermal_zone0/temp"
-        output = subprocess.getoutput(command)
-        return round(int(output.strip()) / 1000, 1)
+        # Whole seconds are enough, skip the float parse
+        uptimeSeconds = int(uptimeOutput.split(".", 1)[0])
+        upTime = formatUpTime(uptimeSeconds)
     except Exception as e:
-        LOG.error(f"getRemoteCPUTemp - Error reading remote CPU temp: {e}")
-        return "N/A"
+        LOG.error(f"getRemoteData - Error reading remote uptime: {e}")
+        uptimeSeconds = None
+        upTime = "N/A"
 
-# === Main ===
-def main():
-    LOG.debug("main - Starting execution")
-    pihole1Ip = '192.168.50.135'
-    pihole2Ip = '127.0.0.1'
+    try:
+        temp = int(tempOutput)
+    except Exception as e:
+        LOG.error(f"getRemoteData - Error reading remote CPU temp: {e}")
+        temp = "N/A"
 
-    user = readFromFile(USER_PATH)
-    password = readFromFile(PW_PATH)
+    if uptimeSeconds is not None and temp != "N/A":
+        REMOTE_CACHE[ip] = (readAt, uptimeSeconds, temp)
+    return upTime, temp
 
-    pihole1RequestsNumber, pihole1Blocked = getPiHoleData(pihole1Ip, password)
-    pihole2RequestsNumber, pihole2Blocked = getPiHoleData(pihole2Ip, password)
+# === Render ===
+# Rasterized text masks keyed by (text, font), most labels repeat every refresh
+GLYPH_CACHE = {}
+GLYPH_CACHE_SIZE = 256
 
-    pihole1UpTime = getRemoteUpTime(pihole1Ip, user, password)
-    pihole1Temp = getRemoteCPUTemp(pihole1Ip, user, password)
+def drawText(image, xy, text, font, fill):
+    key = (text, font)
+    mask = GLYPH_CACHE.get(key)
+    if mask is None:
+        _, _, right, bottom = font.getbbox(text)
+        mask = Image.new('1', (max(right, 1), max(bottom, 1)), 0)
+        ImageDraw.Draw(mask).text((0, 0), text, font=font, fill=255)
+        if len(GLYPH_CACHE) >= GLYPH_CACHE_SIZE:
+            GLYPH_CACHE.clear()
+        GLYPH_CACHE[key] = mask
+    x, y = xy
+    image.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
 
-    pihole2UpTime = getLocalUpTime()
-    pihole2Temp = getLocalCPUTemp()
+# Everything that never changes between refreshes, drawn once
+def buildBaseline(width, height):
+    # Drawn white on black, the panel shows it inverted
+    image = Image.new('1', (width, height), 0)
+    draw = ImageDraw.Draw(image)
+
+    drawText(image, (10, 4), "PiHole .135", FONT_BIG_BOLD, 255)
+    drawText(image, (135, 4), "PiHole .136", FONT_BIG_BOLD, 255)
 
-    battery = getBattery()
+    for x in (10, 135):
+        drawText(image, (x, 25), "REQ:", FONT_SMALL_BOLD, 255)
+        drawText(image, (x, 44), "BLKD:", FONT_SMALL_BOLD, 255)
+        drawText(image, (x, 63), "UP:", FONT_SMALL_BOLD, 255)
+        drawText(image, (x, 82), "TEMP:", FONT_SMALL_BOLD, 255)
+
+    # Separator lines
+    draw.line((127.5, 0, 127.5, 100), fill=255)  # Vertical separator
+    draw.line((0, 101, width, 101), fill=255)   # Horizontal footer separator
+
+    # Battery outline
+    draw.rectangle((10, 107, 70, 117), outline=255)
+    return image
+
+def render(baseline, user, password):
+    pihole1Ip = '192.168.50.135'
+    pihole2Ip = '127.0.0.1'
+
+    # All probes are independent I/O, run them concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        pihole1DataFuture = executor.submit(getPiHoleData, pihole1Ip, password)
+        pihole2DataFuture = executor.submit(getPiHoleData, pihole2Ip, password)
+        pihole1RemoteFuture = executor.submit(getRemoteData, pihole1Ip, user, password)
+        pihole2UpTimeFuture = executor.submit(getLocalUpTime)
+        pihole2TempFuture = executor.submit(getLocalCPUTemp)
+        batteryFuture = executor.submit(getBattery)
+
+    pihole1RequestsNumber, pihole1Blocked = pihole1DataFuture.result()
+    pihole2RequestsNumber, pihole2Blocked = pihole2DataFuture.result()
+    pihole1UpTime, pihole1Temp = pihole1RemoteFuture.result()
+    pihole2UpTime = pihole2UpTimeFuture.result()
+    pihole2Temp = pihole2TempFuture.result()
+    battery = batteryFuture.result()
 
     now_str = datetime.datetime.now().strftime("%d/%m %H:%M")
 
-    epd = epd2in13_V2.EPD()
-    epd.init(epd.PART_UPDATE)
-    width, height = epd.height, epd.width
-    image = Image.new('1', (width, height), 255)
+    image = baseline.copy()
     draw = ImageDraw.Draw(image)
 
-    fontSmall = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 14)
-    fontSmallBold = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 14)
-    fontBigBold = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 16)
-
-    draw.text((10, 4), "PiHole .135", font=fontBigBold, fill=0)
-    draw.text((135, 4), "PiHole .136", font=fontBigBold, fill=0)
-
-    draw.text((10, 25), "REQ:", font=fontSmallBold, fill=0)
-    draw.text((50, 25), f"{pihole1RequestsNumber}", font=fontSmall, fill=0)
-    draw.text((10, 44), "BLKD:", font=fontSmallBold, fill=0)
-    draw.text((60, 44), f"{pihole1Blocked}%", font=fontSmall, fill=0)
-    draw.text((10, 63), "UP:", font=fontSmallBold, fill=0)
-    draw.text((40, 63), f"{pihole1UpTime}", font=fontSmall, fill=0)
-    draw.text((10, 82), "TEMP:", font=fontSmallBold, fill=0)
-    draw.text((60, 82), f"{pihole1Temp}°C", font=fontSmall, fill=0)
-
-    draw.text((135, 25), "REQ:", font=fontSmallBold, fill=0)
-    draw.text((175, 25), f"{pihole2RequestsNumber}", font=fontSmall, fill=0)
-    draw.text((135, 44), "BLKD:", font=fontSmallBold, fill=0)
-    draw.text((185, 44), f"{pihole2Blocked}%", font=fontSmall, fill=0)
-    draw.text((135, 63), "UP:", font=fontSmallBold, fill=0)
-    draw.text((165, 63), f"{pihole2UpTime}", font=fontSmall, fill=0)
-    draw.text((135, 82), "TEMP:", font=fontSmallBold, fill=0)
-    draw.text((185, 82), f"{pihole2Temp}°C", font=fontSmall, fill=0)
+    drawText(image, (50, 25), f"{pihole1RequestsNumber}", FONT_SMALL, 255)
+    drawText(image, (60, 44), f"{pihole1Blocked}%", FONT_SMALL, 255)
+    drawText(image, (40, 63), f"{pihole1UpTime}", FONT_SMALL, 255)
+    drawText(image, (60, 82), f"{formatTemp(pihole1Temp)}°C", FONT_SMALL, 255)
 
-    # Separator lines
-    draw.line((127.5, 0, 127.5, 100), fill=0)  # Vertical separator
-    draw.line((0, 101, width, 101), fill=0)   # Horizontal footer separator
+    drawText(image, (175, 25), f"{pihole2RequestsNumber}", FONT_SMALL, 255)
+    drawText(image, (185, 44), f"{pihole2Blocked}%", FONT_SMALL, 255)
+    drawText(image, (165, 63), f"{pihole2UpTime}", FONT_SMALL, 255)
+    drawText(image, (185, 82), f"{formatTemp(pihole2Temp)}°C", FONT_SMALL, 255)
 
     # Battery
     if isinstance(battery, int):
         batteryBarLength = int(60 * battery / 100)
-        draw.text((85, 105), f"{round(battery)}%", font=fontSmall, fill=0)
+        drawText(image, (85, 105), f"{round(battery)}%", FONT_SMALL, 255)
     else:
         batteryBarLength = 0
-        draw.text((85, 105), "N/A", font=fontSmall, fill=0)
-    draw.rectangle((10, 107, 10 + batteryBarLength, 117), fill=0)
-    draw.rectangle((10, 107, 70, 117), outline=0)
+        drawText(image, (85, 105), "N/A", FONT_SMALL, 255)
+    draw.rectangle((10, 107, 10 + batteryBarLength, 117), fill=255)
 
     # Date-time
-    draw.text((155, 105), now_str, font=fontSmall, fill=0)
+    drawText(image, (155, 105), now_str, FONT_SMALL, 255)
 
-    rotatedImage = image.rotate(180)
-    colorInvertedImage = ImageOps.invert(rotatedImage.convert("L")).convert("1")
-    epd.display(epd.getbuffer(colorInvertedImage))
-    epd.sleep()
+    return image.transpose(Image.ROTATE_180)
+
+def getDirtyWindow(previousBuffer, buffer, linewidth):
+    changed = [i for i, (old, new) in enumerate(zip(previousBuffer, buffer)) if old != new]
+    if not changed:
+        return None
+    columns = [i % linewidth for i in changed]
+    return changed[0] // linewidth, changed[-1] // linewidth, min(columns), max(columns)
+
+# === Main ===
+def main():
+    LOG.debug("main - Starting execution")
+    # Turn SIGTERM (e.g. systemctl stop) into a normal exit so the cleanup below runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    epd = epd2in13_V2.EPD()
+    width, height = epd.height, epd.width
+    linewidth = (epd.width + 7) // 8
+    baseline = buildBaseline(width, height)
+    # Credentials don't change while running, read them once
+    user = readFromFile(USER_PATH)
+    password = readFromFile(PW_PATH)
+    previousBuffer = None
+    cycle = 0
+    # SPI is only opened by the first init(), until then there is no panel to put to sleep
+    panelInitialised = False
+    try:
+        while True:
+            buffer = epd.getbuffer(render(baseline, user, password))
+            # Partial refreshes in between, a full one every FULL_REFRESH_EVERY cycles to clear ghosting
+            if cycle % FULL_REFRESH_EVERY == 0:
+                LOG.debug("main - Full refresh")
+                epd.init(epd.FULL_UPDATE)
+                panelInitialised = True
+                epd.displayPartBaseImage(buffer)
+                # Leaves the analog block on, it's powered off below
+                epd.init(epd.PART_UPDATE)
+                epd.PowerOff()
+            else:
+                # Only send the bounding box of what changed since the last frame
+                window = getDirtyWindow(previousBuffer, buffer, linewidth)
+                if window:
+                    LOG.debug(f"main - Partial refresh of rows {window[0]}-{window[1]}, bytes {window[2]}-{window[3]}")
+                    epd.PowerOn()
+                    epd.displayPartialWindow(buffer, *window)
+                    # Instead of deep sleep, which would lose the RAM and need a reset and full init: keep the
+                    # controller awake but take the panel off its drive voltages until the next refresh
+                    epd.PowerOff()
+                else:
+                    LOG.debug("main - Nothing changed, skipping refresh")
+            previousBuffer = buffer
+            cycle += 1
+            # Wake up on the next interval boundary so the clock stays on the minute
+            time.sleep(REFRESH_INTERVAL - time.time() % REFRESH_INTERVAL)
+    finally:
+        logoutAll()
+        if panelInitialised:
+            epd.sleep()
+        SESSION.close()
 
 if __name__ == "__main__":
     main()